@@ -4,20 +4,15 @@
 #----------------------------------------
 def Model():
     from machine import Pin,ADC
-    LEVEL=0.3
-    ADC=3
+    THRESH=0x4CCC # ~0.3 of full scale 0xFFFF, integer compare - no soft-float
     PIN=25
     # Ensure Pin 25 Low...
-    thePin=Pin(PIN, mode=Pin.IN, pull=Pin.PULL_DOWN, value=ZERO)
-    # Measure ADC Register 3...
-    theVoltage=ReadADC(ADC)
-    if (theVoltage > LEVEL): # 1/3 VSYS, Not Almost Zero? Test As 0.4 Or Greater
-        #
-        theModel='Pico'
-    if (theVoltage < LEVEL): # Close To Zero? Test As 0.022 Or Slight Greater
-        #
-        theModel='Pico W'
+    thePin=Pin(PIN, mode=Pin.IN, pull=Pin.PULL_DOWN, value=0)
+    # Measure ADC Register 3 As Raw uint16...
+    theRaw=ADC(3).read_u16()
+    # 1/3 VSYS On Pico Reads High, Close To Zero On Pico W
+    theModel='Pico W' if theRaw < THRESH else 'Pico'
     #
-    Echo("Pico! Voltage {0} V, Model {1}'".format(theVoltage, theModel))
+    print("Pico! Raw {0}, Model '{1}'".format(theRaw, theModel))
     #
-    return theModel
\ No newline at end of file
+    return theModel
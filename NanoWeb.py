@@ -5,12 +5,22 @@ import socket
 import ure
 import time
 import binascii
+import urandom
+import uos
+import uheapq as heapq
 import ujson as json
 
+_hexlify = binascii.hexlify
+
+# every byte outside the printable ASCII range, for bytes.translate below
+_NONPRINT = bytes(range(0, 32)) + bytes(range(127, 256))
+
 class CredManager:
     def __init__(self, storage = 'wifi.dat'):
         self.storage = storage
         self.credentials = {}
+        self._dirty = False
+        self._flush_pending = False
         self.load()
 
     def load(self) -> None:
@@ -20,9 +30,29 @@ class CredManager:
         except Exception:
             self.credentials = {}
 
-    async def save(self) -> None:
-        with open(self.storage, 'w') as f:
+    def save(self) -> None:
+        # mark dirty and debounce the actual write, so a burst of changes
+        # costs one JSON dump and one flash write instead of one per call;
+        # a burst also only ever spawns a single flush task
+        self._dirty = True
+        if not self._flush_pending:
+            self._flush_pending = True
+            asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep_ms(250)
+        self._flush_pending = False
+        if self._dirty:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._dirty = False
+        # write to a temp file then rename, so a crash mid-write
+        # cannot corrupt the stored credentials
+        tmp = self.storage + '.tmp'
+        with open(tmp, 'w') as f:
             json.dump(self.credentials, f)
+        uos.rename(tmp, self.storage)
 
     def add(self, ssid: str, password: str) -> None:
         self.credentials[ssid] = password
@@ -61,6 +91,9 @@ class ConnectionManager:
         self.wlan_sta = network.WLAN(network.STA_IF)
         self.cred_manager = CredManager()
         self.conn_timeout_sec = conn_timeout_sec
+        self._scan_cache = (0, [])
+        self._scan_busy = False
+        self._scan_evt = asyncio.Event()
 
     async def boot(self, event_loop) -> bool:
         print("starting boot sequence...")
@@ -102,19 +135,58 @@ class ConnectionManager:
         else:
             return ("", "", "", "")
     
-    def scan_available_networks(self) -> List[Tuple[str, str, int]]:
-        """Scans for available networks and returns a list of networks sorted by signal strength
+    def scan_available_networks(self, top_n: int = 16) -> List[Tuple[str, str, int]]:
+        """Scans for available networks and returns the top_n strongest ones sorted by signal strength
 
         Returns:
             list: A list of tuples. Each tuple contains the SSID (str), BSSID (str, MAC address), hidden (bool) and signal strength (int, RSSI value) of a network
         """
         networks = self.wlan_sta.scan()
+        if top_n and len(networks) > top_n:
+            # bounded min-heap of (rssi, index) keeps only the strongest
+            # top_n, which also caps the JSON response size in busy areas
+            heap = []
+            for i in range(len(networks)):
+                rssi = networks[i][3]
+                if len(heap) < top_n:
+                    heapq.heappush(heap, (rssi, i))
+                elif rssi > heap[0][0]:
+                    heapq.heappop(heap)
+                    heapq.heappush(heap, (rssi, i))
+            networks = [networks[i] for _, i in heap]
         sorted_networks = sorted(networks, key=lambda network: network[3], reverse=True)
-        return [
-            (ssid.decode('utf-8'), ':'.join(['{:02x}'.format(b) for b in bssid]), rssi)
-            for ssid, bssid, _, rssi, _, _ in sorted_networks
-            if ssid.decode('utf-8') and self.is_printable(ssid.decode('utf-8'))
-            ]
+        out = []
+        for ssid, bssid, _, rssi, _, _ in sorted_networks:
+            name = ssid.decode('utf-8')  # decode once per network
+            if not name or not self.is_printable(name):
+                continue
+            out.append((name, _hexlify(bssid, b':').decode('ascii'), rssi))
+        return out
+
+    async def scan_available_networks_cached(self, ttl_ms: int = 3000) -> List[Tuple[str, str, int]]:
+        """Scans with a short-lived cache: the blocking radio scan runs at
+        most once per ttl_ms, repeated portal polls are served from the
+        cache, and concurrent callers wait on the in-flight scan instead
+        of triggering another one
+
+        Returns:
+            list: Same format as scan_available_networks
+        """
+        ts, networks = self._scan_cache
+        if networks and time.ticks_diff(time.ticks_ms(), ts) < ttl_ms:
+            return networks
+        if self._scan_busy:
+            await self._scan_evt.wait()
+            return self._scan_cache[1]
+        self._scan_busy = True
+        self._scan_evt.clear()
+        try:
+            networks = self.scan_available_networks()
+            self._scan_cache = (time.ticks_ms(), networks)
+        finally:
+            self._scan_busy = False
+            self._scan_evt.set()
+        return networks
 
     async def connect(self, ssid: str, password: str, timeout_ms: int = 10000) -> bool:
         """Connects to a WiFi network
@@ -128,11 +200,14 @@ class ConnectionManager:
             bool: True if the connection was successful, False otherwise
         """
         print(f"attempting to connect to network: {ssid}...")
-        delay_ms = 1000
+        # start fast so early successes return in ~200 ms; backoff in
+        # retry_until stretches the later attempts out to the timeout budget
+        delay_ms = 200
+        max_retries = _retries_for_budget(timeout_ms, delay_ms)
         self.wlan_sta.active(True)
         self.wlan_sta.connect(ssid, password)
-        
-        if not await self.connected(max_retries = timeout_ms/delay_ms, delay_ms = delay_ms):
+
+        if not await self.connected(max_retries = max_retries, delay_ms = delay_ms):
             # todo - map status to enum
             # https://docs.micropython.org/en/latest/library/network.WLAN.html
             status = self.wlan_sta.status()
@@ -191,7 +266,10 @@ class ConnectionManager:
     
     @staticmethod
     def is_printable(s: str) -> bool:
-        return all(31 < ord(c) < 127 for c in s)
+        # delete the non-printable bytes in a single C-level pass; if the
+        # length is unchanged, none were present
+        b = s.encode('utf-8')
+        return len(b.translate(None, _NONPRINT)) == len(b)
 
     def initialize_access_point(self, event_loop) -> Tuple[str, str, str]:
         ip_address = self.enable_ap()
@@ -219,10 +297,11 @@ class ConnectionManager:
     async def __wifi_scan(self, request) -> None:
         print("Handler: /wifi/scan")
         try:
-            networks = [{"ssid": ssid, "mac": mac, "rssi": rssi}
-                    for ssid, mac, rssi in self.scan_available_networks()]
-            response_json = json.dumps({"networks": networks})
-            await json_write(request, response_json)
+            networks = (
+                b'{"ssid":"%s","mac":"%s","rssi":%d}' % (
+                    _json_escape(ssid).encode('utf-8'), mac.encode('ascii'), rssi)
+                for ssid, mac, rssi in await self.scan_available_networks_cached())
+            await json_stream_write(request, b'networks', networks)
         except Exception as e:
             print(e)
             await json_error(request, 500, "Internal Server Error", "Internal Server Error")
@@ -240,8 +319,11 @@ class ConnectionManager:
                 return
 
             self.cred_manager.add(ssid, password)
-            await self.cred_manager.save()
             await json_write(request, json.dumps({"status": "credentials saved"}))
+        except HttpError:
+            # e.g. the 413 from read(): let handle() report the real
+            # status instead of masking it as a 500
+            raise
         except Exception as e:
             print(e)
             await json_error(request, 500, "Internal Server Error", "Internal Server Error")
@@ -249,10 +331,11 @@ class ConnectionManager:
     async def __wifi_list(self, request) -> None:
         print("Handler: wifi/list")
         try:
-            credentials = [{"ssid": ssid, "password": "****"}
-                    for ssid, password in self.cred_manager.list()]
-            response_json = json.dumps({"credentials": credentials})
-            await json_write(request, response_json)
+            credentials = (
+                b'{"ssid":"%s","password":"****"}' % (
+                    _json_escape(ssid).encode('utf-8'),)
+                for ssid, password in self.cred_manager.list())
+            await json_stream_write(request, b'credentials', credentials)
         except Exception as e:
             print(e)
             await json_error(request, 500, "Internal Server Error", "Internal Server Error")
@@ -261,7 +344,6 @@ class ConnectionManager:
         print("Handler: /wifi/clear")
         try:
             self.cred_manager.clear()
-            await self.cred_manager.save()
             await json_write(request, json.dumps({"status": "credentials cleared"}))
         except Exception as e:
             print(e)
@@ -289,6 +371,7 @@ class Request:
     method = ""
     headers = {}
     route = ""
+    reader = None
     read = None
     write = None
     close = None
@@ -298,44 +381,92 @@ class Request:
         self.method = ""
         self.headers = {}
         self.route = ""
+        self.reader = None
         self.read = None
         self.write = None
         self.close = None
     
+_HTTP_200 = b"HTTP/1.1 200 OK\r\n\r\n"
+
 async def write(request, data):
-    await request.write(data.encode('ISO-8859-1') if type(data) == str else data)
+    # only str payloads (template lines) come through here; static header
+    # chunks are pre-encoded bytes written directly
+    await request.write(data.encode('ISO-8859-1'))
 
 async def read(request):
-    content = ""
+    content = b""
     if 'Content-Length' in request.headers:
         length = int(request.headers['Content-Length'])
-        try: 
-            content = await request.read(length)
+        # the declared length is attacker-controlled: refuse to size a
+        # buffer from it before checking the cap, or a single request
+        # could claim most of the heap
+        if length > _MAX_BODY:
+            raise HttpError(request, 413, "Payload Too Large")
+        # fill one preallocated buffer until the declared length arrives;
+        # a bare read(length) may return short on slow connections and
+        # leave the JSON parser with a truncated body
+        buf = bytearray(length)
+        mv = memoryview(buf)
+        pos = 0
+        try:
+            while pos < length:
+                n = await request.reader.readinto(mv[pos:])
+                if not n:
+                    break
+                pos += n
         except Exception as e:
             print(e)
+        content = bytes(mv[:pos])
     return content
 
 async def error(request, code, reason):
-    await request.write("HTTP/1.1 %s %s\r\n\r\n" % (code, reason))
-    await request.write("<h1>%s</h1>" % (reason))
+    await request.write(
+        ("HTTP/1.1 %s %s\r\n\r\n<h1>%s</h1>" % (code, reason, reason)).encode('ISO-8859-1'))
 
 async def json_read(request):
+    # read outside the try so socket errors are not masked as JSON errors
     content = await read(request)
     try:
         return json.loads(content)
     except Exception as e:
         print(e)
-        return json.loads("{}")
+        return {}
+
+_JSON_200 = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n"
+
+def _json_escape(s):
+    s = s.replace('\\', '\\\\').replace('"', '\\"')
+    for c in s:
+        if ord(c) < 0x20:
+            # rare: a stored SSID with control characters. RFC 8259
+            # requires U+0000-U+001F escaped, so rebuild with \u00xx
+            return ''.join(
+                '\\u%04x' % ord(c) if ord(c) < 0x20 else c for c in s)
+    return s
+
+async def json_stream_write(request, key, items):
+    """Streams {"<key>": [item, ...]} to the socket without ever holding
+    the whole payload in memory. items must yield ready-to-send bytes
+    chunks, one JSON object each"""
+    await request.write(_JSON_200)
+    await request.write(b'{"' + key + b'":[')
+    first = True
+    for chunk in items:
+        if first:
+            first = False
+        else:
+            await request.write(b',')
+        await request.write(chunk)
+    await request.write(b']}')
 
 async def json_write(request, response_json):
-    await request.write("HTTP/1.1 200 OK\r\n")
-    await request.write("Content-Type: application/json\r\n\r\n")
-    await request.write(response_json)
+    if type(response_json) == str:
+        response_json = response_json.encode('ISO-8859-1')
+    await request.write(_JSON_200 + response_json)
 
 async def json_error(request, code, reason, message):
-    await request.write(f"HTTP/1.1 {code} {reason}\r\n")
-    await request.write("Content-Type: application/json\r\n\r\n")
-    await request.write(json.dumps({"error": message}))
+    head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n\r\n" % (code, reason)
+    await request.write((head + json.dumps({"error": message})).encode('ISO-8859-1'))
 
 async def send_file(request, filename, segment=64, binary=False):
     try:
@@ -351,9 +482,36 @@ async def send_file(request, filename, segment=64, binary=False):
         raise HttpError(request, 404, "File Not Found")
 
 
+# per-connection limits so a broken or hostile client cannot feed the
+# parser arbitrarily long lines, endless headers or an oversized body
+_MAX_LINE = 1024
+_MAX_HEADERS = 32
+_MAX_BODY = 8192  # largest body any handler needs is a credentials POST
+
+async def _readline_capped(request, reader, maxlen=_MAX_LINE):
+    line = await reader.readline()
+    if len(line) > maxlen:
+        raise HttpError(request, 431, "Request Header Fields Too Large")
+    return line
+
+
+def _handler_kind(handler):
+    """Classify a route handler once: 0 dict, 1 str, 2 tuple, 3 callable"""
+    if isinstance(handler, dict):
+        return 0
+    if isinstance(handler, str):
+        return 1
+    if isinstance(handler, tuple):
+        return 2
+    return 3
+
+
 class Nanoweb:
 
     extract_headers = ('Authorization', 'Content-Length', 'Content-Type')
+    # bytes header names mapped to their str keys, so header lines can be
+    # matched without decoding every one of them
+    _extract_bytes = {name.encode('ascii'): name for name in extract_headers}
     headers = {}
 
     routes = {}
@@ -368,15 +526,41 @@ class Nanoweb:
     def __init__(self, port=80, address='0.0.0.0'):
         self.port = port
         self.address = address
+        self._exact = {}
+        self._prefixes = ()
+        self._routes_len = -1
+        self._routes_obj = None
+        self._asset_set = frozenset(self.assets_extensions)
 
     def route(self, route):
         """Route decorator"""
         def decorator(func):
             self.routes[route] = func
+            # force a dispatch rebuild: replacing the handler of an
+            # existing route does not change len(self.routes)
+            self._routes_len = -1
             return func
         return decorator
 
-    async def generate_output(self, request, handler):
+    def _rebuild(self):
+        """Precompile routes into an exact-match dict and a wildcard prefix
+        list, so handle() stops re-testing every route per request"""
+        exact = {}
+        prefixes = []
+        for route, handler in self.routes.items():
+            kind = _handler_kind(handler)
+            if route[-1] == '*':
+                prefixes.append((route[:-1], route, kind, handler))
+            else:
+                exact[route] = (kind, handler)
+        # longest prefix first so the most specific wildcard wins
+        prefixes.sort(key=lambda p: len(p[0]), reverse=True)
+        self._exact = exact
+        self._prefixes = tuple(prefixes)
+        self._routes_len = len(self.routes)
+        self._routes_obj = self.routes
+
+    async def generate_output(self, request, handler, kind=None):
         """Generate output from handler
 
         `handler` can be :
@@ -385,16 +569,26 @@ class Nanoweb:
          * tuple where the first item is filename and the second
            is the template context
          * callable, the output of which is sent to the client
+
+        `kind` is the precomputed _handler_kind of the handler; routes
+        registered through _rebuild() pass it in so no isinstance checks
+        run per request
         """
         while True:
-            if isinstance(handler, dict):
+            if kind is None:
+                kind = _handler_kind(handler)
+
+            if kind == 0:
+                # dict: template context rendered against the current url
                 handler = (request.url, handler)
+                kind = 2
+                continue
 
-            if isinstance(handler, str):
-                await write(request, "HTTP/1.1 200 OK\r\n\r\n")
+            if kind == 1:
+                await request.write(_HTTP_200)
                 await send_file(request, handler)
-            elif isinstance(handler, tuple):
-                await write(request, "HTTP/1.1 200 OK\r\n\r\n")
+            elif kind == 2:
+                await request.write(_HTTP_200)
                 filename, context = handler
                 context = context() if callable(context) else context
                 try:
@@ -410,76 +604,94 @@ class Nanoweb:
                 if handler:
                     # handler can returns data that can be fed back
                     # to the input of the function
+                    kind = None
                     continue
             break
 
     async def handle(self, reader, writer):
-        items = await reader.readline()
-        items = items.decode('ascii').split()
-        if len(items) != 3:
+        # parse the request line as bytes; only the three final values
+        # are decoded, no intermediate list or sub-strings
+        line = await reader.readline()
+        if len(line) > _MAX_LINE:
+            # actually drop the connection; a bare return would leave the
+            # socket open until the GC finalizer reaps it
+            await writer.aclose()
+            return
+        method_b, _, rest = line.strip().partition(b' ')
+        url_b, _, version_b = rest.partition(b' ')
+        if not method_b or not url_b or not version_b or b' ' in version_b:
+            await writer.aclose()
             return
 
         request = Request()
+        request.reader = reader
         request.read = reader.read
         request.write = writer.awrite
         request.close = writer.aclose
 
-        request.method, request.url, version = items
+        request.method = method_b.decode('ascii')
+        request.url = url_b.decode('ascii')
+        version = version_b.decode('ascii')
 
         try:
             try:
                 if version not in ("HTTP/1.0", "HTTP/1.1"):
                     raise HttpError(request, 505, "Version Not Supported")
 
+                header_count = 0
                 while True:
-                    items = await reader.readline()
-                    items = items.decode('ascii').split(":", 1)
+                    line = await _readline_capped(request, reader)
+                    name_b, sep, value_b = line.partition(b':')
 
-                    if len(items) == 2:
-                        header, value = items
-                        value = value.strip()
-
-                        if header in self.extract_headers:
-                            request.headers[header] = value
-                    elif len(items) == 1:
+                    if not sep:
                         break
 
+                    header_count += 1
+                    if header_count > _MAX_HEADERS:
+                        raise HttpError(request, 431,
+                                        "Request Header Fields Too Large")
+
+                    header = self._extract_bytes.get(name_b)
+                    if header:
+                        request.headers[header] = value_b.strip().decode('ascii')
+
                 if self.callback_request:
                     self.callback_request(request)
 
-                if request.url in self.routes:
+                if self.routes is not self._routes_obj or len(self.routes) != self._routes_len:
+                    # the routes dict was replaced, grew or shrank since
+                    # the last rebuild; in-place handler replacement is
+                    # caught by route(), which resets _routes_len
+                    self._rebuild()
+
+                entry = self._exact.get(request.url)
+                if entry is not None:
                     # 1. If current url exists in routes
                     request.route = request.url
-                    await self.generate_output(request,
-                                               self.routes[request.url])
+                    await self.generate_output(request, entry[1], entry[0])
                 else:
                     # 2. Search url in routes with wildcard
-                    for route, handler in self.routes.items():
-                        if route == request.url \
-                            or (route[-1] == '*' and
-                                request.url.startswith(route[:-1])):
+                    for prefix, route, kind, handler in self._prefixes:
+                        if request.url.startswith(prefix):
                             request.route = route
-                            await self.generate_output(request, handler)
+                            await self.generate_output(request, handler, kind)
                             break
                     else:
                         # 3. Try to load index file
                         if request.url in ('', '/'):
                             await send_file(request, self.INDEX_FILE)
+                        # 4. Current url have an assets extension ?
+                        elif request.url.rpartition('.')[2] in self._asset_set:
+                            await send_file(
+                                request,
+                                '%s/%s' % (
+                                    self.STATIC_DIR,
+                                    request.url,
+                                ),
+                                binary=True,
+                            )
                         else:
-                            # 4. Current url have an assets extension ?
-                            for extension in self.assets_extensions:
-                                if request.url.endswith('.' + extension):
-                                    await send_file(
-                                        request,
-                                        '%s/%s' % (
-                                            self.STATIC_DIR,
-                                            request.url,
-                                        ),
-                                        binary=True,
-                                    )
-                                    break
-                            else:
-                                raise HttpError(request, 404, "File Not Found")
+                            raise HttpError(request, 404, "File Not Found")
             except HttpError as e:
                 request, code, message = e.args
                 await self.callback_error(request, code, message)
@@ -504,13 +716,25 @@ def get_time():
         '{:02d}h {:02d}:{:02d}'.format(uptime_h, uptime_m, uptime_s),
     )
 
-async def retry_until(predicate, action, max_retries=3, delay_ms=500):
+def _retries_for_budget(timeout_ms, delay_ms, backoff=1.5, max_delay_ms=8000):
+    """Number of retry_until attempts whose backed-off delays fit in timeout_ms"""
+    retries = 0
+    spent = 0
+    while spent < timeout_ms:
+        spent += min(max_delay_ms, int(delay_ms * backoff ** retries))
+        retries += 1
+    return retries
+
+async def retry_until(predicate, action, max_retries=3, delay_ms=500, backoff=1.5, max_delay_ms=8000, jitter_ms=100):
     for i in range(max_retries):
         result = action()
         #print(f"Attempt {i+1} result: {result}")
         if predicate(result):
             return True, result
-        await asyncio.sleep_ms(delay_ms)
+        # capped exponential backoff plus jitter, so fast failures retry
+        # quickly and slow ones do not hammer the radio in lockstep
+        d = min(max_delay_ms, int(delay_ms * backoff ** i)) + urandom.getrandbits(7) % jitter_ms
+        await asyncio.sleep_ms(d)
     #print("Max retries reached. Condition not fulfilled.")
     return False, None
         
@@ -1,71 +1,84 @@
 from ServoDriver import ServoDriver
 
+def _to_pulse(degrees):
+    """Degrees to PIO pulse length, evaluated once at module load so the
+    poses below never pay any per-call math; rounded integer form keeps
+    it float-free on the FPU-less M0+. The span comes from the driver
+    constants so the pose tables track any retuning of the pulse range."""
+    span = ServoDriver.MAX_SERVO_PULSE - ServoDriver.MIN_SERVO_PULSE
+    return (degrees * span + 90) // 180 + ServoDriver.MIN_SERVO_PULSE
+
+def _pose(hip, knee):
+    """Builds a full 8-channel pose table with the right-side mirror
+    (180 - angle) and the pulse lengths already baked in, so posture
+    changes are one batched driver call with no per-servo math"""
+    # channels 0-3 are the right legs (mirrored), 4-7 the left legs
+    return tuple((channel, angle, _to_pulse(angle)) for channel, angle in (
+        (0, 180 - hip), (1, 180 - knee),
+        (2, 180 - hip), (3, 180 - knee),
+        (4, hip), (5, knee),
+        (6, hip), (7, knee)))
+
+_POSE_STRETCH = _pose(0, 90)
+_POSE_FOLD = _pose(0, 170)
+_POSE_STAND = _pose(135, 0)
+_POSE_HOVER = _pose(90, 90)
+
 class Leg:
     def __init__(self, hipServoId, kneeServoId, servoDriver, mirror = False):
         self.hipServoId = hipServoId
         self.kneeServoId = kneeServoId
         self.mirror = mirror
         self.driver = servoDriver
-        
-    def __resolve(self, angle):
-        if self.mirror:
-            return 180 - angle
-        else:
-            return angle
-    
+        # bind the mirror transform once so hip()/knee() carry no branch,
+        # and bake the four static poses into per-leg (hip, knee) tuples
+        resolve = (lambda a: 180 - a) if mirror else (lambda a: a)
+        self._resolve = resolve
+        self._stretch = (resolve(0), resolve(90))
+        self._fold = (resolve(0), resolve(170))
+        self._stand = (resolve(135), resolve(0))
+        self._hover = (resolve(90), resolve(90))
+
     def hip(self, angle):
-        self.driver.setPosition(self.hipServoId, self.__resolve(angle))
+        self.driver.set_servo_angle(self.hipServoId, self._resolve(angle))
 
     def knee(self, angle):
-        self.driver.setPosition(self.kneeServoId, self.__resolve(angle))
-        
+        self.driver.set_servo_angle(self.kneeServoId, self._resolve(angle))
+
+    def __pose(self, pose):
+        self.driver.set_servo_angle(self.hipServoId, pose[0])
+        self.driver.set_servo_angle(self.kneeServoId, pose[1])
+
     def forward_stretch(self):
-        self.hip(0)
-        self.knee(90)
-        
+        self.__pose(self._stretch)
+
     def forward_fold(self):
-        self.hip(0)
-        self.knee(170)
+        self.__pose(self._fold)
 
     def stand(self):
-        self.hip(135)
-        self.knee(0)
-        
+        self.__pose(self._stand)
+
     def hover(self):
-        self.hip(90)
-        self.knee(90)
+        self.__pose(self._hover)
 
 class RoboDog:
-    
+
     def __init__(self):
         self.driver = ServoDriver()
         self.rightFrontLeg = Leg(0,1,self.driver,True)
         self.rightHindLeg = Leg(2,3,self.driver,True)
         self.leftFrontLeg = Leg(4,5,self.driver,False)
         self.leftHindLeg = Leg(6,7,self.driver,False)
-        
+
     def forward_stretch(self):
-        self.rightFrontLeg.forward_stretch()
-        self.leftFrontLeg.forward_stretch()
-        self.rightHindLeg.forward_stretch()
-        self.leftHindLeg.forward_stretch()
+        self.driver.set_positions_raw(_POSE_STRETCH)
 
     def forward_fold(self):
-        self.rightFrontLeg.forward_fold()
-        self.leftFrontLeg.forward_fold()
-        self.rightHindLeg.forward_fold()
-        self.leftHindLeg.forward_fold()
-        
+        self.driver.set_positions_raw(_POSE_FOLD)
+
     def stand(self):
-        self.rightFrontLeg.stand()
-        self.leftFrontLeg.stand()
-        self.rightHindLeg.stand()
-        self.leftHindLeg.stand()
-        
+        self.driver.set_positions_raw(_POSE_STAND)
+
     def hover(self):
-        self.rightFrontLeg.hover()
-        self.leftFrontLeg.hover()
-        self.rightHindLeg.hover()
-        self.leftHindLeg.hover()
-        
+        self.driver.set_positions_raw(_POSE_HOVER)
 
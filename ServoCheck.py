@@ -1,16 +1,28 @@
-from SimplyServos import SimplyServos
-from time import sleep
+import uasyncio as asyncio
+from ServoDriver import ServoDriver
 from machine import Pin
 
-servos = SimplyServos()
+servos = ServoDriver()
 led = Pin(25, Pin.OUT)
 
-while True:
-    led.toggle()
-    for i in range(1):
-        servos.goToPosition(i,0)
-    sleep(1)
-    led.toggle()
-    for i in range(8):
-        servos.goToPosition(i,180)
-    sleep(1)
\ No newline at end of file
+# precomputed sweep endpoints, applied as one batched write each
+_ALL_LOW = tuple((i, 0) for i in range(8))
+_ALL_HIGH = tuple((i, 180) for i in range(8))
+
+async def _blink():
+    while True:
+        led.toggle()
+        servos.set_positions(_ALL_LOW)
+        await asyncio.sleep_ms(1000)
+        led.toggle()
+        servos.set_positions(_ALL_HIGH)
+        await asyncio.sleep_ms(1000)
+
+async def main():
+    asyncio.create_task(_blink())
+    # keep the loop alive; other tasks (e.g. the Nanoweb portal) can
+    # be scheduled alongside the sweep
+    while True:
+        await asyncio.sleep_ms(60000)
+
+asyncio.run(main())
@@ -1,9 +1,39 @@
 # Pico Servo Driver
 # ServoDriver: uses the PIO state machines to drive a servo
+import array
+import gc
+import uasyncio as asyncio
 from machine import Pin
+from micropython import const
 from rp2 import PIO, StateMachine, asm_pio
 from time import sleep
 
+# compile-time constants for the write hot path: const() values are inlined
+# into the bytecode, so no class-dict walk happens at runtime
+_MIN_PULSE = const(2000)
+_MAX_PULSE = const(10000)
+_PULSE_TRAIN = const(80000)
+_PULSE_SPAN = const(8000)
+_DEG_TO_PULSE = 8000/180  # kept only for the public DEGREES_TO_PULSE_LEN alias
+
+
+# the PIO program lives at module level: it is assembled exactly once and
+# shared by every ServoDriver instance / state machine, with no instance
+# attribute resolution when the StateMachines are constructed
+# (generates the pulse width modulation signal required by the servo)
+@asm_pio(sideset_init=PIO.OUT_LOW)
+def _servo_pwm():
+    # first we clear the pin to zero, then load the registers. Y is always 80000 - 20uS, x is the pulse 'on' length.
+    pull(noblock) .side(0)
+    mov(x, osr) # keep most recent pull data stashed in X, for recycling by noblock
+    mov(y, isr) # ISR must be preloaded with PWM count max
+    # this is where the looping work is done. the overall loop rate is 4Mhz (clock is 8Mhz - we have 2 instructions to do)
+    label("loop")
+    jmp(x_not_y, "skip") # if there is 'excess' Y number leave the pin alone and jump to the 'skip' label until we get to the X value
+    jmp(y_dec, "loop") .side(1) # reached the X value: drive the pin high on the count-down itself (no extra nop cycle). x is always > 0 here: __init__ queues a real pulse into the TX FIFO before activating the SM, so the first pull(noblock) never recycles the power-on X of 0, and every later write clamps to MIN_SERVO_PULSE
+    label("skip")
+    jmp(y_dec, "loop") #count down y by 1 and jump to pwmloop. When y is 0 we will go back to the 'pull' command
+
 
 class InternalServoDriverException(Exception):
     pass
@@ -14,223 +44,267 @@ class UnregisteredServoException(Exception):
 class InvalidServoSettingException(Exception):
     pass
 
+# Driver class used to control servos using the PIO state machines.
+# Docstrings are kept as comments on purpose: on-device every docstring is a
+# heap-allocated str object, and mpy-cross only strips them at -O3.
 class ServoDriver:
-    """
-    Driver class used to control servos using the PIO state machines
-    """
     # servo : 0 degrees -> pulse of 0.5ms, 180 degrees 2.5ms
     # pulse train freq 50hz - 20mS
-    # 1uS is freq of 1000000
-    # servo pulses range from 500 to 2500usec and overall pulse train is 20000usec repeat
-    MIN_SERVO_PULSE = 500
-    MAX_SERVO_PULSE = 2500
-    PULSE_TRAIN = 20000
-    DEGREES_TO_PULSE_LEN = 2000/180
-    
-    # this code drives a pwm on the PIO. It is running at 2Mhz, which gives the PWM a 1uS resolution. 
-    @asm_pio(sideset_init=PIO.OUT_LOW)
-    def _servo_pwm():
-        """
-        Private method to generate the pulse width modulation signal required by the servo
-        """
-        # first we clear the pin to zero, then load the registers. Y is always 20000 - 20uS, x is the pulse 'on' length.     
-        pull(noblock) .side(0)
-        mov(x, osr) # keep most recent pull data stashed in X, for recycling by noblock
-        mov(y, isr) # ISR must be preloaded with PWM count max
-        # this is where the looping work is done. the overall loop rate is 1Mhz (clock is 2Mhz - we have 2 instructions to do)    
-        label("loop")
-        jmp(x_not_y, "skip") # if there is 'excess' Y number leave the pin alone and jump to the 'skip' label until we get to the X value
-        nop()         .side(1)
-        label("skip")
-        jmp(y_dec, "loop") #count down y by 1 and jump to pwmloop. When y is 0 we will go back to the 'pull' command
-             
+    # all lengths are in PIO counts of 250ns (8Mhz clock, 2 instructions
+    # per count): 500-2500usec pulses are 2000-10000 counts and the
+    # 20000usec pulse train is 80000 counts - 4x finer positioning than
+    # the old 1uS resolution, with all the extra work staying in the PIO
+    MIN_SERVO_PULSE = _MIN_PULSE
+    MAX_SERVO_PULSE = _MAX_PULSE
+    PULSE_TRAIN = _PULSE_TRAIN
+    DEGREES_TO_PULSE_LEN = _DEG_TO_PULSE
+
+    # the pwm itself is driven by the module-level _servo_pwm PIO program,
+    # running at 8Mhz, which gives the PWM a 250nS resolution.
+
+    # Parks the PWM count max in the ISR of a freshly claimed state machine.
+    # One helper for the put/pull/mov sequence, so the boot path does the
+    # three host-to-SM round trips once per servo with no re-indexing.
+    @staticmethod
+    def _preload_isr(sm, val) -> None:
+        sm.put(val)
+        sm.exec("pull()")
+        sm.exec("mov(isr, osr)")
+
     # simply stops and starts the servo PIO, so the pin could be used for soemthing else.
+    # Registers a servo with the ServoDriver by activating its state machine.
     def register_servo(self, servo: int) -> None:
-        """
-        Registers a servo with the ServoDriver by activating its state machine
-
-        Parameters:
-            servo (int): The index of the servo to register.
-        """
-        if(not self.servos[servo].active()):
-            self.servos[servo].active(1)
+        # active(1) is already a no-op on a running SM; skip the extra
+        # active() query round trip
+        self.servos[servo].active(1)
+        self._active[servo] = 1
 
+    # Unregisters a servo from the ServoDriver by deactivating its state machine.
     def unregister_servo(self, servo: int) -> None:
-        """
-        Unregisters a servo from the ServoDriver by deactivating its state machine
-
-        Parameters:
-            servo (int): The index of the servo to unregister
-        """
-        if(self.servos[servo].active()):
-            self.servos[servo].active(0)
+        self.servos[servo].active(0)
+        self._active[servo] = 0
 
+    # Returns the current angle of a given servo.
+    # Raises UnregisteredServoException if invalid servo is passed.
     def get_servo_angle(self, servo: int) -> int:
-        """
-        Returns the current angle of a given servo
-
-        Parameters:
-            servo (int): The index of the servo
-
-        Returns:
-            int: The current angle of the servo
-
-        Raises:
-            UnregisteredServoException: If invalid servo is passed
-        """
         self.__validate_servo(servo)
         return self.servo_angles[servo]
 
+    # Sets the angle of a given servo.
+    # Raises UnregisteredServoException / InvalidServoSettingException.
     def set_servo_angle(self, servo: int, degrees: int) -> None:
-        """
-        Sets the angle of a given servo
+        self.__servo_angle(servo, degrees)
 
-        Parameters:
-            servo (int): The index of the servo
-            degrees (int): The desired angle for the servo
+    # Sets several servo angles in one batched call: validates every
+    # (servo, degrees) pair up front, then issues all the writes back to
+    # back so the servos start moving together instead of one per call.
+    # Raises UnregisteredServoException / InvalidServoSettingException.
+    def set_positions(self, pairs) -> None:
+        pairs = tuple(pairs)
+        for servo, degrees in pairs:
+            self.__validate_servo(servo)
+            self.__validate_angle(degrees)
+        for servo, degrees in pairs:
+            self.__write_servo(servo, self.__calc_pulse_length(degrees))
+            self.servo_angles[servo] = degrees
+
+    # Sets servos 0..len(degrees_list)-1 from a flat sequence of angles.
+    # Validates everything up front, then fans the writes out through the
+    # cached put callables with no Python-level intermediates. Hot-path
+    # callers (e.g. a gait generator) can pass a preallocated
+    # array.array('B') so the call itself allocates nothing.
+    # Raises UnregisteredServoException / InvalidServoSettingException.
+    def set_servo_angles(self, degrees_list) -> None:
+        n = len(degrees_list)
+        for i in range(n):
+            self.__validate_servo(i)
+            self.__validate_angle(degrees_list[i])
+        put = self._put
+        lut = self._pulse_lut
+        angles = self.servo_angles
+        for i in range(n):
+            d = degrees_list[i]
+            put[i](lut[d])
+            angles[i] = d
+
+    # Sets several servos from precomputed (servo, degrees, pulse_length)
+    # triples, skipping the per-call degrees-to-pulse arithmetic entirely;
+    # callers precompute the pulse lengths once (see RoboDog's pose tables).
+    # degrees is carried along so the cached angles stay accurate.
+    # Raises UnregisteredServoException if invalid servo is passed.
+    def set_positions_raw(self, triples) -> None:
+        triples = tuple(triples)
+        for servo, _, _ in triples:
+            self.__validate_servo(servo)
+        for servo, degrees, pulse_length in triples:
+            self.__write_servo(servo, pulse_length)
+            self.servo_angles[servo] = degrees
+
+    # Private fast-path writer: LUT index, direct put, cache update.
+    # Callers must already have validated the servo and the angle; the
+    # endpoints of a sweep bound every intermediate step, so no in-loop
+    # clamping or re-validation is needed.
+    # With drop_if_full the write is skipped while the TX FIFO already
+    # holds 2+ pending pulses: the PIO only consumes one word per 20 ms
+    # pulse train, so fast sweeps would otherwise stall the CPU on a
+    # blocking put. Dropped steps trade a little smoothness for
+    # responsiveness; the angle cache is only updated on actual writes.
+    def _set_angle_unchecked(self, servo: int, degrees: int, drop_if_full: bool = False) -> None:
+        if drop_if_full and self._txf[servo]() >= 2:
+            return
+        self._put[servo](self._pulse_lut[degrees])
+        self.servo_angles[servo] = degrees
 
-        Raises:
-            UnregisteredServoException: If invalid servo is passed
-            InvalidServoSettingException: If the desired angle exceeds the maximum angle
-        """
-        self.__servo_angle(servo, degrees)
-        
+    # Smoothly sets the angle of a given servo by moving in small steps,
+    # sleeping `delay` seconds between steps (blocking variant).
+    # Raises UnregisteredServoException / InvalidServoSettingException.
     def set_servo_angle_smooth(self, servo: int, degrees: int, delay: float = 0.01, step: int = 1) -> None:
-        """
-        Smoothly sets the angle of a given servo by moving in small steps
-
-        Parameters:
-            servo (int): The index of the servo
-            degrees (int): The final desired angle for the servo
-            delay (float, optional): The delay between each step. Default is 0.01
-            step (int, optional): The size of each step. Default is 1
-
-        Raises:
-            UnregisteredServoException: If invalid servo is passed
-            InvalidServoSettingException: If the desired angle exceeds the maximum angle
-        """
-        current_angle = self.servo_angles[servo]
-        if degrees < current_angle:
-            for angle in range(current_angle, degrees - 1, -step):
-                self.__servo_angle(servo, angle)
-                sleep(delay)
-        else:
-            for angle in range(current_angle, degrees + 1, step):
-                self.__servo_angle(servo, angle)
-                sleep(delay)
-
+        # validate once up front; the loop below runs unchecked
+        self.__validate_servo(servo)
+        self.__validate_angle(degrees)
+        # manual counter instead of range(): no iterator allocation per sweep
+        angle = self.servo_angles[servo]
+        if angle == degrees:
+            return
+        sgn = -step if degrees < angle else step
+        while (sgn < 0 and angle >= degrees) or (sgn > 0 and angle <= degrees):
+            self._set_angle_unchecked(servo, angle, True)
+            sleep(delay)
+            angle += sgn
+        # make sure the final position lands even if the last step dropped
+        if self.servo_angles[servo] != angle - sgn:
+            self._set_angle_unchecked(servo, angle - sgn)
+
+    # Smoothly sets the angle of a given servo without blocking the event
+    # loop: awaits delay_ms between steps, so other uasyncio tasks (e.g.
+    # the NanoWeb portal) keep servicing sockets during the sweep.
+    # Raises UnregisteredServoException / InvalidServoSettingException.
+    async def set_servo_angle_smooth_async(self, servo: int, degrees: int, delay_ms: int = 10, step: int = 1) -> None:
+        # validate once up front; the loop below runs unchecked
+        self.__validate_servo(servo)
+        self.__validate_angle(degrees)
+        # manual counter instead of range(): no iterator allocation per sweep
+        angle = self.servo_angles[servo]
+        if angle == degrees:
+            return
+        sgn = -step if degrees < angle else step
+        while (sgn < 0 and angle >= degrees) or (sgn > 0 and angle <= degrees):
+            self._set_angle_unchecked(servo, angle, True)
+            await asyncio.sleep_ms(delay_ms)
+            angle += sgn
+        # make sure the final position lands even if the last step dropped
+        if self.servo_angles[servo] != angle - sgn:
+            self._set_angle_unchecked(servo, angle - sgn)
+
+    # Private method that looks up the pulse length corresponding to a given angle.
     def __calc_pulse_length(self, degrees: int) -> int:
-        """
-        Private method that calculates the pulse length corresponding to a given angle
-
-        Parameters:
-            degrees (int): The angle
+        return self._pulse_lut[degrees]
 
-        Returns:
-            int: The pulse length corresponding to the angle
-        """
-        return int(degrees * self.DEGREES_TO_PULSE_LEN + self.MIN_SERVO_PULSE)
-
-    # set_servo_angle takes a degree position for the servo to goto. 
-    # 0 degrees->180 degrees is 0->2000us, plus offset of 500uS
-    # 1 degree ~ 11uS.
-    # this function does the sum then calls __write_servo to actually poke the PIO 
+    # set_servo_angle takes a degree position for the servo to goto.
+    # 0 degrees->180 degrees is 0->8000 counts, plus offset of 2000 counts
+    # 1 degree ~ 44 counts (~11uS).
+    # this function does the sum then calls __write_servo to actually poke the PIO
+    # Raises UnregisteredServoException / InvalidServoSettingException.
     def __servo_angle(self, servo: int, degrees: int) -> None:
-        """
-        Private method that sets the angle of a given servo and keeps a track of the current angle
-
-        Parameters:
-            servo (int): The index of the servo
-            degrees (int): The desired angle for the servo
-
-        Raises:
-            UnregisteredServoException: If invalid servo is passed
-            InvalidServoSettingException: If the desired angle exceeds the maximum angle
-        """
         self.__validate_servo(servo)
         self.__validate_angle(degrees)
-        pulse_length = self.__calc_pulse_length(degrees)
-        self.__write_servo(servo, pulse_length)
+        if self.servo_angles[servo] == degrees:
+            return # already there - skip the pulse math and the FIFO write
+        # LUT indexed directly; no method call or float math on the hot path
+        self.__write_servo(servo, self._pulse_lut[degrees])
         self.servo_angles[servo] = degrees
-    
+
+    # Private method that writes the pulse length to a given servo and actually changes the servo angle.
     def __write_servo(self, servo: int, pulse_length: int) -> None:
-        """
-        Private method that writes the pulse length to a given servo and actually changes the servo angle
-
-        Parameters:
-            servo (int): The index of the servo
-            pulse_length (int): The pulse length to write to the servo
-
-        """
-        if(pulse_length < self.MIN_SERVO_PULSE):
-            pulse_length = self.MIN_SERVO_PULSE
-        if(pulse_length > self.MAX_SERVO_PULSE):
-            pulse_length = self.MAX_SERVO_PULSE
+        if(pulse_length < _MIN_PULSE):
+            pulse_length = _MIN_PULSE
+        if(pulse_length > _MAX_PULSE):
+            pulse_length = _MAX_PULSE
         # check if servo SM is active, otherwise we are trying to control a thing we do not have control over
-        if self.servos[servo].active():
-            self.servos[servo].put(pulse_length)
+        # (cached flag + cached put callable: no dict walks or bound-method
+        # allocation per write)
+        if self._active[servo]:
+            self._put[servo](pulse_length)
 
+    # Validates if the given servo is registered.
     def __validate_servo(self, servo: int) -> None:
-        """
-        Validates if the given servo is registered
-
-        Parameters:
-            servo (int): The index of the servo
-
-        Raises:
-            UnregisteredServoException: If invalid servo is passed
-        """
-        if(not self.servos[servo].active()):
-            raise UnregisteredServoException(f"Servo is unknown or unregistered: {servo}")
-
+        if(not self._active[servo]):
+            # plain constant message: no format template in the constant
+            # pool and no per-raise string building
+            raise UnregisteredServoException("servo unregistered")
+
+    # Validates that the given angle lies within 0..max_angle. The lower
+    # bound matters: a negative angle would index the pulse LUT from the
+    # end (lut[-1] is the max-angle pulse), slamming the servo to the
+    # opposite extreme before the bytearray angle cache even rejects it.
     def __validate_angle(self, degrees: int) -> None:
-        """
-        Validates if the given angle does not exceed the maximum angle
-
-        Parameters:
-            degrees (int): The angle to validate
-
-        Raises:
-            InvalidServoSettingException: If the angle exceeds the maximum angle
-        """
-        if degrees > self.max_angle:
-            raise InvalidServoSettingException(f"Desired angle {degrees} exceeds maximum angle {self.max_angle}.")
+        if degrees < 0 or degrees > self.max_angle:
+            raise InvalidServoSettingException("angle out of range")
 
     # class initialisation
     # defaults to the standard pins and freq for the kitronik board, but could be overridden
     # servo pins on the Simply Servos board are: GP2, GP3, GP4, GP5, GP6, GP7, GP8, GP9 for servos 1-8 in order
+    # Initializes the ServoDriver with a given list of servo pins and sets all servos to an initial angle.
     def __init__(self, servo_pins: List[int] = [2,3,4,5,6,7,8,9], max_angle = 180, initial_angle: int = 90):
-        """
-        Initializes the ServoDriver with a given list of servo pins and sets all servos to an initial angle
-
-        Parameters:
-            servo_pins (List[int], optional): A list of servo pins. Default is [2,3,4,5,6,7,8,9]
-            initial_angle (int, optional): The initial angle for all servos. Default is 90
-        """
         self.servo_count = len(servo_pins)
         self.servo_pins = servo_pins
-        self.used_state_machines = [False] * self.servo_count
-        self.servos = []
-        self.servo_angles = [0] * self.servo_count  # initialize empty list for servo angles
+        # preallocate the per-servo lists at their final size and assign by
+        # index: no list growth/reallocation while the heap is still tidy
+        # at boot. _put/_txf cache the bound put/tx_fifo callables and
+        # _active holds an active-state byte per servo
+        self.servos = [None] * self.servo_count
+        self._put = [None] * self.servo_count
+        self._txf = [None] * self.servo_count
+        self._active = bytearray(self.servo_count)
+        # angle cache as a bytearray: one contiguous unboxed byte per servo
+        # instead of a list of int objects (falls back to a list for servos
+        # whose max angle does not fit a byte)
+        self.servo_angles = bytearray(self.servo_count) if max_angle <= 255 else [0] * self.servo_count
         self.max_angle = max_angle
-
-        # connect the servos by default on initialization
+        # one-time degrees->pulse table: the set-angle hot path indexes this
+        # instead of paying the soft-float multiply on the FPU-less M0+.
+        # built with rounded integer math ((d * span + 90) // 180), so no
+        # float object is ever created - small ints stay unboxed
+        self._pulse_lut = array.array('H', (
+            (d * _PULSE_SPAN + 90) // 180 + _MIN_PULSE
+            for d in range(max_angle + 1)))
+
+        # construct each Pin exactly once up front; the SM-claim retry loop
+        # below must not re-instantiate Pin objects on every attempt
+        pins = [Pin(p) for p in self.servo_pins]
+
+        # connect the servos by default on initialization; the cursor only
+        # moves forward, so already-claimed SM ids are never retried
+        sm_cursor = 0
         for i in range(self.servo_count):
-            for j in range(self.servo_count): # StateMachine range based on servo_pins
-                if self.used_state_machines[j]:
-                    continue # ignore this index if already used
-                try:
-                    self.servos.append(StateMachine(j, self._servo_pwm, freq=2000000, sideset_base=Pin(self.servo_pins[i])))
-                    self.used_state_machines[j] = True # set this index to used
-                    break 
-                except ValueError:
-                    pass # external resouce has SM, move on
-                if j == self.servo_count - 1:
+            while True:
+                if sm_cursor > 7: # RP2040 has 8 StateMachines (2 PIOs x 4)
                     # cannot find an unused SM
                     raise ValueError("Could not claim a StateMachine, all in use")
-                
-            self.servos[i].put(self.PULSE_TRAIN)
-            self.servos[i].exec("pull()")
-            self.servos[i].exec("mov(isr, osr)")
+                try:
+                    sm = StateMachine(sm_cursor, _servo_pwm, freq=8000000, sideset_base=pins[i])
+                    sm_cursor += 1
+                    break
+                except ValueError:
+                    sm_cursor += 1 # external resouce has SM, move on
+            self.servos[i] = sm
+
+            self._preload_isr(sm, _PULSE_TRAIN)
+            self._put[i] = sm.put
+            self._txf[i] = sm.tx_fifo
+            # queue the first pulse BEFORE activating the SM: the initial
+            # pull(noblock) must load a real pulse length, not recycle the
+            # power-on X of 0 - with x == 0 the side-set on the compare
+            # path would latch the pin high and the loop never wraps back
+            # to pull. Bypasses __write_servo since the servo is not yet
+            # marked active; the LUT value is already within clamp range.
+            self.__validate_angle(initial_angle)
+            self._put[i](self._pulse_lut[initial_angle])
             self.register_servo(i)
-            self.__servo_angle(i, initial_angle)
+            self.servo_angles[i] = initial_angle
+
+        # setup is the last big burst of allocation; sweep its garbage now
+        # and raise the gc threshold above the surviving live set, so the
+        # steady-state servo loop is not interrupted by early collections
+        gc.collect()
+        gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
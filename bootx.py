@@ -1,7 +1,12 @@
+import gc
 import uasyncio as asyncio
-from NanoWeb import ConnectionManager 
 
 async def main():
+    # import NanoWeb lazily and collect first, so its compile happens
+    # against a defragmented heap instead of the import-time litter left
+    # by boot - the largest allocation this script makes
+    gc.collect()
+    from NanoWeb import ConnectionManager
     event_loop = asyncio.get_event_loop()
     manager = ConnectionManager()
     success = await manager.boot(event_loop)
@@ -12,5 +17,5 @@ async def main():
         print("auto connect failed - starting access portal")
         (ap_ssid, ap_password, ap_ip) = manager.initialize_access_point(event_loop)
         event_loop.run_forever()
-    
-asyncio.run(main())
\ No newline at end of file
+
+asyncio.run(main())
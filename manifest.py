@@ -0,0 +1,15 @@
+# MicroPython freeze manifest
+# Build the firmware with FROZEN_MANIFEST pointing here (e.g.
+#   make BOARD=RPI_PICO_W FROZEN_MANIFEST=path/to/manifest.py)
+# so the project modules land in flash as frozen bytecode and import
+# without the "source + compiled bytecode both in RAM" peak, and with
+# zero parse/compile cost at boot.
+include("$(PORT_DIR)/boards/manifest.py")
+
+freeze(".", (
+    "ServoDriver.py",
+    "SimplyServos.py",
+    "RoboDog.py",
+    "NanoWeb.py",
+    "Model.py",
+))